@@ -1,13 +1,22 @@
 import os
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from langchain.prompts import PromptTemplate
 from tools.llm_manager import get_llm_response
 from dotenv import load_dotenv
-import json
 from tools.data_synthesizer import synthesize_analyses
 from tools.data_analyzer import analyze_individual_dataset
-from tools.utils import parse_json_with_fix, read_dataset_sample
+from tools.utils import parse_json_with_fix, read_dataset_sample, json_dumps
+
+def positive_int(value):
+    """
+    Argparse type for options that must be a whole number of at least 1.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 def main():
     """
@@ -21,12 +30,17 @@ def main():
                         help="Optional: Path to save the harmonization map JSON output.")
     parser.add_argument("--llm_providers", type=str, default="google,nvidia,groq",
                         help="Comma-separated list of LLM providers to use, in order of preference (e.g., 'google,nvidia,groq').")
+    parser.add_argument("--max_workers", type=positive_int, default=4,
+                        help="Maximum number of concurrent LLM requests during individual dataset analysis.")
+    parser.add_argument("--race_providers", action="store_true",
+                        help="Query all LLM providers at once for the first dataset and use whichever answers first.")
     args = parser.parse_args()
 
     folder_path = args.folder_path
     additional_prompt = args.prompt
     output_json_path = args.output_json
     llm_providers = [p.strip() for p in args.llm_providers.split(',')]
+    max_workers = args.max_workers
 
     if not os.path.isdir(folder_path):
         print(f"Error: The path '{folder_path}' is not a valid directory.")
@@ -34,11 +48,10 @@ def main():
 
     all_analyses = {}
     print("--- Phase 1: Individual Dataset Analysis ---")
-    successful_provider = None
+    datasets = []
     for filename in os.listdir(folder_path):
         file_path = os.path.join(folder_path, filename)
         if os.path.isfile(file_path):
-            print(f"Analyzing {filename}...")
             df_sample = read_dataset_sample(file_path)
             if df_sample is not None:
                 metadata_content = None
@@ -52,22 +65,40 @@ def main():
                         try:
                             with open(metadata_file_path, 'r', encoding='utf-8') as f:
                                 metadata_content = f.read()
-                            print(f"  Found metadata file: {metadata_filename}")
+                            print(f"  Found metadata file for {filename}: {metadata_filename}")
                             break # Found metadata, no need to check other extensions
                         except Exception as e:
                             print(f"  Error reading metadata file {metadata_filename}: {e}")
 
-                providers_to_try = [successful_provider] if successful_provider else llm_providers
-                analysis, provider = analyze_individual_dataset(file_path, df_sample, providers_to_try, metadata_content)
+                datasets.append((filename, file_path, df_sample, metadata_content))
+
+    # Analyze one dataset at a time until a provider succeeds, then stick with that provider
+    successful_provider = None
+    while datasets and not successful_provider:
+        filename, file_path, df_sample, metadata_content = datasets.pop(0)
+        print(f"Analyzing {filename}...")
+        analysis, provider = analyze_individual_dataset(file_path, df_sample, llm_providers, metadata_content, args.race_providers)
+        if analysis:
+            all_analyses[filename] = analysis
+            if provider:
+                successful_provider = provider
+                # Also update the main list to prioritize the successful one for the synthesis phase
+                if provider in llm_providers:
+                    llm_providers.remove(provider)
+                    llm_providers.insert(0, provider)
+
+    # The remaining datasets are independent LLM round trips, so issue them concurrently
+    if datasets:
+        print(f"Analyzing {len(datasets)} remaining datasets with up to {max_workers} concurrent requests...")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda dataset: analyze_individual_dataset(dataset[1], dataset[2], [successful_provider], dataset[3]),
+                datasets
+            )
+            # executor.map yields in submission order, so the synthesis prompt sees datasets in a stable order
+            for (filename, _, _, _), (analysis, _) in zip(datasets, results):
                 if analysis:
                     all_analyses[filename] = analysis
-                    if provider:
-                        successful_provider = provider
-                        # Also update the main list to prioritize the successful one for the synthesis phase
-                        if provider in llm_providers:
-                            llm_providers.remove(provider)
-                            llm_providers.insert(0, provider)
-
 
     if not all_analyses:
         print("No datasets were successfully analyzed.")
@@ -82,16 +113,19 @@ def main():
         print(f"Error during synthesis: {harmonization_map}")
         return
 
+    # Serialize once and reuse the string for both the console and the output file
+    harmonization_map_json = json_dumps(harmonization_map, indent=2)
     print("\n--- Harmonization Map (JSON) ---")
-    print(json.dumps(harmonization_map, indent=2))
+    print(harmonization_map_json)
 
     if output_json_path:
         output_dir = os.path.dirname(output_json_path)
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
         try:
-            with open(output_json_path, 'w') as f:
-                json.dump(harmonization_map, f, indent=2)
+            # orjson writes raw UTF-8, so don't let the platform default encoding (e.g. cp1252) re-encode it
+            with open(output_json_path, 'w', encoding='utf-8') as f:
+                f.write(harmonization_map_json)
             print(f"\nHarmonization map saved to: {output_json_path}")
         except Exception as e:
             print(f"Error saving harmonization map to {output_json_path}: {e}")
@@ -4,45 +4,11 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import PromptTemplate
 import json
 from tools.llm_manager import get_llm_response
-from tools.utils import parse_json_with_fix, get_unique_values_sample, read_dataset_sample, read_full_dataset
+from tools.utils import parse_json_with_fix, extract_json_block, get_unique_values_sample, get_unique_values_sample_from_path, read_dataset_sample, get_dataset_shape_and_null_counts
 
-def analyze_individual_dataset(file_path, df_sample, llm_providers, metadata_content=None):
-    """
-    Analyzes a single dataset to understand its structure and semantic meaning.
-    df_sample: A sample of the dataframe for LLM analysis.
-    Returns the analysis and the name of the successful provider.
-    """
-    metadata_instruction = ""
-    if metadata_content:
-        metadata_instruction = f"\n\nAdditional Metadata (if available and relevant):\n{{metadata_content}}"
-
-    unique_values_sample = get_unique_values_sample(df_sample)
-
-    # Read the full dataset to get accurate shape and NaN counts
-    df_full = read_full_dataset(file_path)
-    if df_full is None:
-        print(f"Error: Could not read full dataset from {file_path} for shape and NaN counts.")
-        return None, None
-
-    # Clean column names by stripping whitespace
-    df_full.columns = df_full.columns.str.strip()
-
-    dataset_shape = list(df_full.shape)
-    nan_null_counts = df_full.isnull().sum().to_dict()
-
-    template = f"""
-    You are a data analyst. Your task is to perform a deep semantic analysis of the following dataset sample.
-
-    Dataset File: {{file_name}}
-    Sample Data (JSON format):
-    {{dataset_sample}}
-
-    Sample of Unique Values per Column:
-    {{unique_values_sample}}
-
-    Dataset Shape (rows, columns): {{dataset_shape}}
-    NaN/Null Counts per Column: {{nan_null_counts}}
-    {metadata_instruction}
+# Static instructions come first and the per-dataset data last, so providers' prefix prompt caching can reuse the prefix
+ANALYSIS_INSTRUCTIONS = """
+    You are a data analyst. Your task is to perform a deep semantic analysis of the dataset sample provided at the end of this prompt.
 
     Your analysis should be in JSON format and include:
     1.  **semantic_meaning**: For each column, describe what it likely represents in the real world.
@@ -52,12 +18,59 @@ def analyze_individual_dataset(file_path, df_sample, llm_providers, metadata_con
     5.  **nan_null_counts**: A dictionary of NaN/Null counts per column.
 
     Provide only the JSON output, with no additional text or markdown formatting.
+"""
+
+DATASET_CONTEXT_TEMPLATE = """
+    Dataset File: {file_name}
+    Sample Data (JSON format):
+    {dataset_sample}
+
+    Sample of Unique Values per Column:
+    {unique_values_sample}
+
+    Dataset Shape (rows, columns): {dataset_shape}
+    NaN/Null Counts per Column: {nan_null_counts}
+"""
+
+METADATA_CONTEXT_TEMPLATE = """
+    Additional Metadata (if available and relevant):
+    {metadata_content}
+"""
+
+# Both prompt variants are assembled once at import instead of concatenated on every call
+ANALYSIS_PROMPT = PromptTemplate(
+    template=ANALYSIS_INSTRUCTIONS + DATASET_CONTEXT_TEMPLATE,
+    input_variables=["file_name", "dataset_sample", "unique_values_sample", "dataset_shape", "nan_null_counts"]
+)
+ANALYSIS_WITH_METADATA_PROMPT = PromptTemplate(
+    template=ANALYSIS_INSTRUCTIONS + DATASET_CONTEXT_TEMPLATE + METADATA_CONTEXT_TEMPLATE,
+    input_variables=ANALYSIS_PROMPT.input_variables + ["metadata_content"]
+)
+
+def analyze_individual_dataset(file_path, df_sample, llm_providers, metadata_content=None, race_providers=False):
     """
+    Analyzes a single dataset to understand its structure and semantic meaning.
+    df_sample: A sample of the dataframe for LLM analysis.
+    race_providers: Ask all providers at once and keep the first answer (see get_llm_response).
+    Returns the analysis and the name of the successful provider.
+    """
+    # Distinct values from the whole file, which the few sampled rows may not show; the sample is the fallback
+    unique_values_sample = get_unique_values_sample_from_path(file_path)
+    if unique_values_sample is None:
+        unique_values_sample = get_unique_values_sample(df_sample)
+
+    # Get accurate shape and NaN counts over the whole file without loading it all into memory
+    dataset_shape, nan_null_counts = get_dataset_shape_and_null_counts(file_path)
+    if dataset_shape is None:
+        print(f"Error: Could not read full dataset from {file_path} for shape and NaN counts.")
+        return None, None
+
+    template = (ANALYSIS_WITH_METADATA_PROMPT if metadata_content else ANALYSIS_PROMPT).template
 
     input_variables = {
         "file_name": os.path.basename(file_path),
         "dataset_sample": df_sample.to_json(orient='records', indent=2),
-        "unique_values_sample": json.dumps(unique_values_sample, indent=2),
+        "unique_values_sample": json.dumps(unique_values_sample, indent=2, default=str), # Excel dates are not JSON types
         "dataset_shape": dataset_shape,
         "nan_null_counts": json.dumps(nan_null_counts, indent=2)
     }
@@ -66,9 +79,9 @@ def analyze_individual_dataset(file_path, df_sample, llm_providers, metadata_con
 
 
     try:
-        result_content, successful_provider = get_llm_response(template, input_variables, llm_providers)
+        result_content, successful_provider = get_llm_response(template, input_variables, llm_providers, race=race_providers)
         print(f"Raw LLM response: {result_content}") # Debugging line
-        cleaned_result = result_content.strip().replace("```json", "").replace("```", "")
+        cleaned_result = extract_json_block(result_content)
         # Use the robust JSON parser from main.py
         return parse_json_with_fix(cleaned_result), successful_provider
     except Exception as e:
@@ -2,11 +2,12 @@ import polars as pl
 import json
 import os
 import argparse
+import functools
 from tools.llm_manager import get_llm_response
 from tools.data_analyzer import analyze_individual_dataset
 from tools.data_synthesizer import synthesize_analyses
 from langchain.prompts import PromptTemplate
-from tools.utils import read_dataset_sample
+from tools.utils import read_dataset_sample, json_loads, json_dumps, list_dataset_files
 
 import inspect
 
@@ -15,8 +16,8 @@ def load_harmonization_map(json_file_path):
     Loads the harmonization map from a JSON file.
     """
     try:
-        with open(json_file_path, 'r') as f:
-            return json.load(f)
+        with open(json_file_path, 'rb') as f:
+            return json_loads(f.read())
     except FileNotFoundError:
         print(f"Error: Harmonization map file not found at {json_file_path}")
         return None
@@ -24,117 +25,347 @@ def load_harmonization_map(json_file_path):
         print(f"Error: Could not decode JSON from {json_file_path}. Please ensure it's valid JSON.")
         return None
 
-def read_dataset(file_path):
+@functools.lru_cache(maxsize=64)
+def _parse_dataset(file_path, mtime, size):
+    """
+    Parses a dataset file (CSV or Excel) into a Polars DataFrame.
+    Cached on (path, mtime, size) so repeated reads within a plan reuse the parsed frame.
+    CSVs are normally scanned lazily, so the cache mostly holds Excel frames; plan_and_execute_manipulation clears it.
+    """
+    if file_path.endswith('.csv'):
+        return pl.read_csv(file_path, ignore_errors=True)
+    try:
+        # The calamine engine (fastexcel) parses straight into Arrow columns without a pandas round-trip
+        return pl.read_excel(file_path, engine="calamine")
+    except ImportError:
+        try:
+            import pandas as pd
+            return pl.from_pandas(pd.read_excel(file_path))
+        except ImportError:
+            print("Error: fastexcel or pandas is required for reading Excel files. Please install one (`pip install fastexcel`).")
+            return None
+
+def read_dataset(file_path, scan=False):
     """
     Reads a dataset file (CSV or Excel) and returns a Polars DataFrame.
+    With scan=True, returns a LazyFrame so that callers can push projections down into the reader.
     """
     try:
-        if file_path.endswith('.csv'):
-            return pl.read_csv(file_path, ignore_errors=True)
-        elif file_path.endswith(('.xlsx', '.xls')):
-            # Polars requires 'xlsx2csv' or similar for direct Excel reading
-            # For simplicity, we'll use pandas to read and then convert to Polars
-            # For production, consider direct Polars Excel readers if available or convert to CSV first
-            try:
-                import pandas as pd
-                return pl.from_pandas(pd.read_excel(file_path))
-            except ImportError:
-                print("Error: pandas is required for reading Excel files. Please install it (`pip install pandas`).")
-                return None
-        else:
+        if not file_path.endswith(('.csv', '.xlsx', '.xls')):
             print(f"Unsupported file format for {file_path}. Only .csv, .xlsx, .xls are supported.")
             return None
+        if scan and file_path.endswith('.csv'):
+            return pl.scan_csv(file_path, ignore_errors=True)
+
+        abs_path = os.path.abspath(file_path)
+        df = _parse_dataset(abs_path, os.path.getmtime(abs_path), os.path.getsize(abs_path))
+        if df is None:
+            return None
+        return df.lazy() if scan else df
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
         return None
 
-def standardize_dataframe_columns(df: pl.DataFrame, filename: str, harmonization_map: list, verbose: bool = False):
+def _file_plan(harmonization_map: list, filename: str):
+    """
+    Builds a hashable (canonical_name, original_column_candidates) plan for one file.
+    """
+    return tuple(
+        (feature_group["canonical_name"], tuple(feature_group["original_columns"].get(filename, [])))
+        for feature_group in harmonization_map
+    )
+
+def _build_file_plans(harmonization_map: list):
+    """
+    Builds the per-file plans for every file referenced in the harmonization map in a single pass.
     """
-    Renames columns in a Polars DataFrame to canonical names based on the harmonization map.
-    Returns a new DataFrame with standardized column names and only canonical features.
+    canonical_names = [feature_group["canonical_name"] for feature_group in harmonization_map]
+    candidates_by_file = {}
+    for idx, feature_group in enumerate(harmonization_map):
+        for filename, original_cols in feature_group["original_columns"].items():
+            candidates = candidates_by_file.setdefault(filename, [()] * len(harmonization_map))
+            candidates[idx] = tuple(original_cols)
+    return {filename: tuple(zip(canonical_names, candidates)) for filename, candidates in candidates_by_file.items()}
+
+@functools.lru_cache(maxsize=256)
+def _rename_exprs(file_plan: tuple, columns_tuple: tuple):
     """
-    # Create a list of expressions for selecting and renaming columns
+    Builds the select/rename expressions for a file plan against a given column schema.
+    Cached so repeated calls on the same file schema reuse the compiled expression list.
+    Returns None when none of the canonical features has a source column in the schema.
+    """
+    columns = set(columns_tuple)
     select_exprs = []
-    for feature_group in harmonization_map:
-        canonical_name = feature_group["canonical_name"]
-        original_cols = feature_group["original_columns"].get(filename, [])
-        
-        found_col_expr = None
-        for col in original_cols:
-            if col in df.columns:
-                found_col_expr = pl.col(col).alias(canonical_name)
-                break
-        
-        if found_col_expr is not None:
-            select_exprs.append(found_col_expr)
+    found_any = False
+    for canonical_name, original_cols in file_plan:
+        found_col = next((col for col in original_cols if col in columns), None)
+        if found_col is not None:
+            found_any = True
+            select_exprs.append(pl.col(found_col).alias(canonical_name))
         else:
             # If no original column is found, add a null column with the canonical name
             select_exprs.append(pl.lit(None).alias(canonical_name))
+    return select_exprs if found_any else None
+
+@functools.lru_cache(maxsize=256)
+def _parse_time_plan(file_plan: tuple, columns_tuple: tuple):
+    """
+    Builds the rename map for scan_csv's with_column_names and the projection to run on the renamed columns.
+    Returns None when renaming at parse time would produce duplicate column names, e.g. when one original
+    column feeds two canonical features or a canonical name is already used by another column.
+    """
+    renames = {}
+    for canonical_name, original_cols in file_plan:
+        found_col = next((col for col in original_cols if col in columns_tuple), None)
+        if found_col is not None:
+            if found_col in renames:
+                return None
+            renames[found_col] = canonical_name
+    renamed_columns = [renames.get(col, col) for col in columns_tuple]
+    if len(set(renamed_columns)) != len(renamed_columns):
+        return None
+
+    select_exprs = [
+        pl.col(canonical_name) if canonical_name in renames.values() else pl.lit(None).alias(canonical_name)
+        for canonical_name, _ in file_plan
+    ]
+    return renames, select_exprs
+
+def _source_column(file_plan: tuple, columns_tuple: tuple, canonical_name: str):
+    """
+    Returns the original column that feeds a canonical feature in a file, or None if the file lacks it.
+    """
+    for name, original_cols in file_plan:
+        if name == canonical_name:
+            return next((col for col in original_cols if col in columns_tuple), None)
+    return None
 
+def standardize_dataframe_columns(df, filename: str, harmonization_map: list, verbose: bool = False, plan_for_file: tuple = None):
+    """
+    Renames columns in a Polars DataFrame or LazyFrame to canonical names based on the harmonization map.
+    Returns a new frame of the same kind with standardized column names and only canonical features,
+    or None if the file contains none of the canonical features.
+    plan_for_file: Optional precomputed plan from _build_file_plans, to skip walking the harmonization map.
+    """
+    if plan_for_file is None:
+        plan_for_file = _file_plan(harmonization_map, filename)
+    # collect_schema() only reads the header for a LazyFrame, so the expressions are built once per scan
+    select_exprs = _rename_exprs(plan_for_file, tuple(df.collect_schema().names()))
+    if select_exprs is None:
+        if verbose:
+            print(f"Warning: No canonical features found in '{filename}'.")
+        return None
     return df.select(select_exprs)
 
+def _scan_standardized_datasets(harmonization_map: list, data_folder_path: str, filenames: list, verbose: bool = False,
+                                required_feature: str = None):
+    """
+    Scans the given dataset files and standardizes their columns.
+    CSV files sharing a schema and standardization plan are read with one multi-file scan_csv,
+    so Polars parallelizes across them natively. Returns a list of standardized LazyFrames.
+    Files without any canonical column, or without required_feature when given, are skipped before parsing.
+    """
+    file_plans = _build_file_plans(harmonization_map)
+    csv_groups = {}
+    lazy_frames = []
+    for filename in filenames:
+        file_path = os.path.join(data_folder_path, filename)
+        plan_for_file = file_plans.get(filename) or _file_plan(harmonization_map, filename)
+        lf = read_dataset(file_path, scan=True)
+        if lf is None:
+            continue
+        try:
+            # Group on names and inferred dtypes so a shared scan never coerces one file to another's types
+            schema = tuple(lf.collect_schema().items())
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}")
+            continue
+        columns_tuple = tuple(name for name, _ in schema)
+
+        if required_feature is not None and _source_column(plan_for_file, columns_tuple, required_feature) is None:
+            if verbose:
+                print(f"Warning: Canonical feature '{required_feature}' not found in '{filename}'. Skipping this file.")
+            continue
+        select_exprs = _rename_exprs(plan_for_file, columns_tuple)
+        if select_exprs is None:
+            if verbose:
+                print(f"Warning: No canonical features found in '{filename}'. Skipping this file.")
+            continue
+
+        if file_path.endswith('.csv'):
+            csv_groups.setdefault((plan_for_file, schema), []).append(file_path)
+        else:
+            lazy_frames.append(lf.select(select_exprs))
+
+    for (plan_for_file, schema), file_paths in csv_groups.items():
+        columns_tuple = tuple(name for name, _ in schema)
+        parse_time_plan = _parse_time_plan(plan_for_file, columns_tuple)
+        if parse_time_plan is None:
+            lazy_frames.append(pl.scan_csv(file_paths, ignore_errors=True).select(_rename_exprs(plan_for_file, columns_tuple)))
+            continue
+        # Rename to canonical names while parsing, so the plan only projects and never re-aliases columns
+        renames, select_exprs = parse_time_plan
+        lf = pl.scan_csv(file_paths, ignore_errors=True,
+                         with_column_names=lambda names, renames=renames: [renames.get(name, name) for name in names])
+        lazy_frames.append(lf.select(select_exprs))
+    return lazy_frames
+
 def get_unique_values_for_canonical_feature(harmonization_map: list, canonical_feature_name: str, data_folder_path: str, verbose: bool = False):
     """
     Retrieves all unique values for a given canonical feature across all relevant datasets.
     """
-    unique_values = set()
-    found_feature = False
-
+    filenames = None
     for feature_group in harmonization_map:
         if feature_group.get("canonical_name") == canonical_feature_name:
-            found_feature = True
-            original_columns_map = feature_group.get("original_columns", {})
-
-            for filename, columns in original_columns_map.items():
-                file_path = os.path.join(data_folder_path, filename)
-                df = read_dataset(file_path)
-                if df is not None:
-                    standardized_df = standardize_dataframe_columns(df, filename, harmonization_map, verbose=verbose)
-                    if canonical_feature_name in standardized_df.columns:
-                        # Use .unique() on the Series and convert to string for consistency
-                        unique_values.update(standardized_df[canonical_feature_name].cast(pl.Utf8).unique().to_list())
-                    else:
-                        if verbose:
-                            print(f"Warning: Canonical column '{canonical_feature_name}' not found in standardized DataFrame for '{filename}'.")
+            filenames = list(feature_group.get("original_columns", {}))
             break
 
-    if not found_feature:
+    if filenames is None:
         if verbose:
             print(f"Error: Canonical feature '{canonical_feature_name}' not found in the harmonization map.")
+        return []
 
-    return sorted(list(unique_values))
+    lazy_frames = [
+        # Cast to string for consistency; only the canonical column is projected out of the files
+        standardized_lf.select(pl.col(canonical_feature_name).cast(pl.Utf8).unique())
+        for standardized_lf in _scan_standardized_datasets(harmonization_map, data_folder_path, filenames, verbose=verbose,
+                                                           required_feature=canonical_feature_name)
+    ]
+    if not lazy_frames:
+        return []
 
-def merge_datasets_by_canonical_key(harmonization_map: list, data_folder_path: str, merge_key_canonical_name: str, verbose: bool = False):
+    # Union and deduplicate on the Polars side; only the final distinct values become Python objects
+    unique_lf = pl.concat(lazy_frames, how="vertical_relaxed", rechunk=False).unique().sort(canonical_feature_name)
+    try:
+        return unique_lf.collect(engine="streaming").to_series().to_list()
+    except Exception as e:
+        print(f"Error collecting unique values for '{canonical_feature_name}': {e}")
+        return []
+
+def _collect_or_sink(lf: pl.LazyFrame, sink_to: str = None):
+    """
+    Runs a LazyFrame on the streaming engine, either collecting it or streaming it into a CSV file.
+    Returns the collected DataFrame, or the LazyFrame itself once it has been written to sink_to.
+    """
+    if sink_to:
+        output_dir = os.path.dirname(sink_to)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        lf.sink_csv(sink_to)
+        return lf
+    return lf.collect(engine="streaming")
+
+def merge_datasets_by_canonical_key(harmonization_map: list, data_folder_path: str, merge_key_canonical_name: str, verbose: bool = False, sink_to: str = None,
+                                    coalesce_by_key: bool = False):
     """
     Merges all datasets in the specified folder based on a common canonical key.
     Returns a single merged Polars DataFrame.
+    By default every row of every file is kept, stacked under the canonical columns.
+    With coalesce_by_key=True the result has one row per key, holding each column's first non-null value across files.
+    That value depends on file order and may come from a different source row for each column.
+    If sink_to is set, the merged result is streamed to that CSV path and the uncollected LazyFrame is returned.
     """
-    merged_pl_df = None
-    all_files = [f for f in os.listdir(data_folder_path) if os.path.isfile(os.path.join(data_folder_path, f))]
+    # Every standardized frame carries all canonical columns, so the merge key is either in all of them or in none
+    if merge_key_canonical_name not in (feature_group["canonical_name"] for feature_group in harmonization_map):
+        if verbose:
+            print(f"Warning: Merge key '{merge_key_canonical_name}' not found in the harmonization map. Nothing to merge.")
+        return None
 
-    for filename in all_files:
-        file_path = os.path.join(data_folder_path, filename)
-        pl_df = read_dataset(file_path)
-        if pl_df is not None:
-            standardized_pl_df = standardize_dataframe_columns(pl_df, filename, harmonization_map, verbose=verbose)
-            
-            if merge_key_canonical_name not in standardized_pl_df.columns:
-                if verbose:
-                    print(f"Warning: Merge key '{merge_key_canonical_name}' not found in standardized DataFrame for '{filename}'. Skipping merge for this file.")
-                continue
+    all_files = list_dataset_files(data_folder_path)
+    lazy_frames = _scan_standardized_datasets(harmonization_map, data_folder_path, all_files, verbose=verbose,
+                                              required_feature=merge_key_canonical_name)
+    if not lazy_frames:
+        return None
 
-            if merged_pl_df is None:
-                merged_pl_df = standardized_pl_df
-            else:
-                # Polars join, handling potential duplicate columns by selecting distinct ones
-                # This is a simplified approach; more complex scenarios might need careful column selection
-                merged_pl_df = merged_pl_df.join(standardized_pl_df, on=merge_key_canonical_name, how='outer', suffix=f"_from_{filename.replace('.', '_')}")
-                
-    return merged_pl_df
+    # Stacking the frames replaces the N-way outer join (and its suffixed duplicate columns) with a single pass
+    merged_pl_lf = pl.concat(lazy_frames, how="diagonal_relaxed", rechunk=False)
+    if coalesce_by_key:
+        merged_pl_lf = merged_pl_lf.group_by(merge_key_canonical_name, maintain_order=True).agg(pl.all().drop_nulls().first())
+    try:
+        return _collect_or_sink(merged_pl_lf, sink_to)
+    except Exception as e:
+        print(f"Error reading datasets from {data_folder_path}: {e}")
+        return None
 
-def filter_dataframe_by_canonical_value(df: pl.DataFrame, canonical_feature_name: str, value: str, verbose: bool = False):
+def _exact_number(value, integer: bool):
     """
-    Filters a Polars DataFrame based on a specific value in a canonical feature column.
+    Converts a filter value for comparison with a numeric column.
+    Raises ValueError unless the conversion is exact, so 10.9 never matches 10 and True never matches 1.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Boolean {value} is not compared as a number")
+    if not integer:
+        return float(value)
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"{value} is not an integer")
+    return int(value)
+
+def _canonical_value_predicate(canonical_feature_name: str, value, dtype):
+    """
+    Builds an equality predicate on a canonical column, or a membership predicate when value is a list.
+    Compares natively for string and numeric columns and only casts to Utf8 when a value does not convert exactly.
+    """
+    values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+    column = pl.col(canonical_feature_name)
+    typed_values = None
+    if dtype == pl.Utf8:
+        typed_values = [str(v) for v in values]
+    elif dtype.is_numeric():
+        try:
+            typed_values = [_exact_number(v, dtype.is_integer()) for v in values]
+        except (TypeError, ValueError):
+            typed_values = None
+
+    if typed_values is None:
+        # Cast to Utf8 for consistent string comparison
+        column = column.cast(pl.Utf8)
+        typed_values = [str(v) for v in values]
+
+    if len(typed_values) == 1:
+        return column == typed_values[0]
+    return column.is_in(typed_values)
+
+def scan_and_filter_all(harmonization_map: list, data_folder_path: str, canonical_feature_name: str, value, verbose: bool = False, sink_to: str = None):
+    """
+    Filters all datasets in the specified folder by a value (or list of values) of a canonical feature.
+    The predicate is pushed into each file scan, so only matching rows are ever materialized.
+    Returns a single Polars DataFrame with canonical column names.
+    If sink_to is set, the matching rows are streamed to that CSV path and the uncollected LazyFrame is returned.
+    """
+    # Same all-or-none check as in merge_datasets_by_canonical_key
+    if canonical_feature_name not in (feature_group["canonical_name"] for feature_group in harmonization_map):
+        if verbose:
+            print(f"Error: Canonical feature '{canonical_feature_name}' not found in the harmonization map.")
+        return None
+
+    all_files = list_dataset_files(data_folder_path)
+    lazy_frames = [
+        standardized_lf.filter(_canonical_value_predicate(canonical_feature_name, value,
+                                                          standardized_lf.collect_schema()[canonical_feature_name]))
+        for standardized_lf in _scan_standardized_datasets(harmonization_map, data_folder_path, all_files, verbose=verbose,
+                                                           required_feature=canonical_feature_name)
+    ]
+    if not lazy_frames:
+        return None
+
+    try:
+        return _collect_or_sink(pl.concat(lazy_frames, how="diagonal_relaxed", rechunk=False), sink_to)
+    except Exception as e:
+        print(f"Error reading datasets from {data_folder_path}: {e}")
+        return None
+
+def _print_preview(df: pl.DataFrame, n: int = 5):
+    """
+    Prints the first rows of a DataFrame as a markdown table using Polars' own formatter.
+    """
+    # Show every column and untruncated values, like the pandas to_markdown preview this replaced
+    with pl.Config(tbl_formatting="MARKDOWN", tbl_hide_column_data_types=True, tbl_hide_dataframe_shape=True,
+                   tbl_cols=-1, fmt_str_lengths=1000):
+        print(df.head(n))
+
+def filter_dataframe_by_canonical_value(df: pl.DataFrame, canonical_feature_name: str, value, verbose: bool = False):
+    """
+    Filters a Polars DataFrame based on a specific value (or list of values) in a canonical feature column.
     Assumes the DataFrame already has canonical column names.
     """
     if canonical_feature_name not in df.columns:
@@ -142,8 +373,7 @@ def filter_dataframe_by_canonical_value(df: pl.DataFrame, canonical_feature_name
             print(f"Error: Canonical feature '{canonical_feature_name}' not found in the DataFrame.")
         return pl.DataFrame() # Return empty DataFrame
     
-    # Cast to Utf8 for consistent string comparison
-    return df.filter(pl.col(canonical_feature_name).cast(pl.Utf8) == value)
+    return df.filter(_canonical_value_predicate(canonical_feature_name, value, df.schema[canonical_feature_name]))
 
 def get_unique_values_from_df(df: pl.DataFrame, canonical_feature_name: str, verbose: bool = False):
     """
@@ -159,28 +389,47 @@ def get_unique_values_from_single_file(file_path: str, harmonization_map: list,
     """
     Retrieves all unique values for a given canonical feature from a single specified dataset file.
     """
-    df = read_dataset(file_path)
-    if df is None:
+    lf = read_dataset(file_path, scan=True)
+    if lf is None:
         if verbose:
             print(f"Error: Could not read dataset from {file_path}.")
         return []
     
     # Extract filename from file_path for standardize_dataframe_columns
     filename = os.path.basename(file_path)
-    standardized_df = standardize_dataframe_columns(df, filename, harmonization_map, verbose=verbose)
+    standardized_lf = standardize_dataframe_columns(lf, filename, harmonization_map, verbose=verbose)
     
-    if canonical_feature_name not in standardized_df.columns:
+    if standardized_lf is None or canonical_feature_name not in standardized_lf.collect_schema().names():
         if verbose:
             print(f"Error: Canonical feature '{canonical_feature_name}' not found in the standardized DataFrame for {filename}.")
         return []
     
-    return standardized_df[canonical_feature_name].cast(pl.Utf8).unique().to_list()
-
-def plan_and_execute_manipulation(harmonization_map: list, data_folder_path: str, user_request: str, llm_providers: list, cli_args):
-    """
-    Uses an LLM (Planner Agent) to generate a data manipulation plan and then executes it.
-    """
-    available_functions_description = """
+    # Selecting a single column lets the CSV reader skip parsing every other field
+    try:
+        unique_df = standardized_lf.select(pl.col(canonical_feature_name).cast(pl.Utf8).unique()).collect()
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return []
+    return unique_df[canonical_feature_name].to_list()
+
+# Parameters only the CLI may set; sink_to writes files, so an LLM plan must not reach it
+_CLI_ONLY_PARAMS = frozenset({"sink_to"})
+
+# Functions the planner may call, with the parameter names each accepts, resolved once at import time
+PLANNER_FUNCTIONS = {
+    func.__name__: (func, frozenset(inspect.signature(func).parameters) - _CLI_ONLY_PARAMS)
+    for func in (
+        standardize_dataframe_columns,
+        get_unique_values_for_canonical_feature,
+        merge_datasets_by_canonical_key,
+        filter_dataframe_by_canonical_value,
+        get_unique_values_from_df,
+        get_unique_values_from_single_file,
+        scan_and_filter_all,
+    )
+}
+
+AVAILABLE_FUNCTIONS_DESCRIPTION = """
     You have the following Polars-based data manipulation functions available:
 
     1.  `standardize_dataframe_columns(df, filename, harmonization_map)`:
@@ -193,14 +442,14 @@ def plan_and_execute_manipulation(harmonization_map: list, data_folder_path: str
         -   **Inputs**: `harmonization_map` (list), `canonical_feature_name` (string), `data_folder_path` (string).
         -   **Output**: A sorted list of unique values (strings).
 
-    3.  `merge_datasets_by_canonical_key(harmonization_map, data_folder_path, merge_key_canonical_name)`:
-        -   **Description**: Merges all datasets in the specified folder based on a common canonical key. Returns a single merged Polars DataFrame.
-        -   **Inputs**: `harmonization_map` (list), `data_folder_path` (string), `merge_key_canonical_name` (string).
+    3.  `merge_datasets_by_canonical_key(harmonization_map, data_folder_path, merge_key_canonical_name, coalesce_by_key=False)`:
+        -   **Description**: Merges all datasets in the specified folder based on a common canonical key. Returns a single merged Polars DataFrame that keeps every row of every dataset.
+        -   **Inputs**: `harmonization_map` (list), `data_folder_path` (string), `merge_key_canonical_name` (string), `coalesce_by_key` (optional boolean; only set it to true when the user explicitly wants one row per key, which keeps the first non-null value of each column and drops the rest).
         -   **Output**: A merged Polars DataFrame.
 
     4.  `filter_dataframe_by_canonical_value(df, canonical_feature_name, value)`:
         -   **Description**: Filters a Polars DataFrame based on a specific value in a canonical feature column. Assumes the DataFrame already has canonical column names.
-        -   **Inputs**: `df` (Polars DataFrame), `canonical_feature_name` (string), `value` (string).
+        -   **Inputs**: `df` (Polars DataFrame), `canonical_feature_name` (string), `value` (string, or a list of strings to match any of them).
         -   **Output**: A filtered Polars DataFrame.
 
     5.  `get_unique_values_from_df(df, canonical_feature_name)`:
@@ -208,14 +457,17 @@ def plan_and_execute_manipulation(harmonization_map: list, data_folder_path: str
         -   **Inputs**: `df` (Polars DataFrame), `canonical_feature_name` (string).
         -   **Output**: A list of unique values (strings).
 
+    6.  `scan_and_filter_all(harmonization_map, data_folder_path, canonical_feature_name, value)`:
+        -   **Description**: Filters all datasets in the folder by a value of a canonical feature, reading only matching rows. Prefer this over merging and then filtering when no merge is required.
+        -   **Inputs**: `harmonization_map` (list), `data_folder_path` (string), `canonical_feature_name` (string), `value` (string, or a list of strings to match any of them).
+        -   **Output**: A Polars DataFrame with canonical column names.
+
     Your task is to generate a JSON plan that describes the sequence of operations to fulfill the user's request. The plan should be a list of objects, where each object represents a step. Each step must have:
     -   `"function"`: The name of the function to call (e.g., "merge_datasets_by_canonical_key").
     -   `"args"`: An object containing the arguments for the function. Arguments should be directly mappable to the function's parameters. For `df` arguments, use a placeholder like `"_current_df_"` if the DataFrame is an output from a previous step, or `"_all_datasets_"` if it implies loading all datasets.
     -   `"output_variable"`: (Optional) The name of a variable to store the output of this step (e.g., "merged_data").
 
-    The harmonization map for the current datasets is provided below. You MUST use the `canonical_name` values from this map when referring to features in your plan. Do NOT use original column names or make up new canonical names.
-
-Harmonization Map: {harmonization_map_json}
+    The harmonization map for the current datasets is provided at the end of this prompt. You MUST use the `canonical_name` values from this map when referring to features in your plan. Do NOT use original column names or make up new canonical names.
 
 When the user asks to find unique values for a canonical feature across all datasets, you should directly use the `get_unique_values_for_canonical_feature` function. Do NOT attempt to merge datasets first for this specific type of request, as it can be inefficient.
 
@@ -258,17 +510,30 @@ Example Plan (Merge and then Filter):
     ]
     ```
 
+Harmonization Map: {harmonization_map_json}
+
 User Request: {user_request}
     """
 
-    planner_prompt = PromptTemplate(template=available_functions_description, input_variables=["user_request", "harmonization_map_json"])
-    
+PLANNER_PROMPT = PromptTemplate(template=AVAILABLE_FUNCTIONS_DESCRIPTION, input_variables=["user_request", "harmonization_map_json"])
+
+def plan_and_execute_manipulation(harmonization_map: list, data_folder_path: str, user_request: str, llm_providers: list, cli_args):
+    """
+    Uses an LLM (Planner Agent) to generate a data manipulation plan and then executes it.
+    Parsed Excel frames are shared between the steps of the plan and released once it finishes.
+    """
+    try:
+        return _plan_and_execute_manipulation(harmonization_map, data_folder_path, user_request, llm_providers, cli_args)
+    finally:
+        _parse_dataset.cache_clear()
+
+def _plan_and_execute_manipulation(harmonization_map: list, data_folder_path: str, user_request: str, llm_providers: list, cli_args):
     print("Generating manipulation plan with LLM...")
-    harmonization_map_json = json.dumps(harmonization_map, indent=2)
+    harmonization_map_json = json_dumps(harmonization_map) # Serialized once for the verbose print and the prompt
     if cli_args.verbose:
-        print(f"Prompting LLM with: {planner_prompt.template.format(user_request=user_request, harmonization_map_json=harmonization_map_json)}")
+        print(f"Prompting LLM with: {PLANNER_PROMPT.format(user_request=user_request, harmonization_map_json=harmonization_map_json)}")
     try:
-        plan_json_str = get_llm_response(planner_prompt.template, {"user_request": user_request, "harmonization_map_json": harmonization_map_json}, llm_providers)
+        plan_json_str, _ = get_llm_response(PLANNER_PROMPT.template, {"user_request": user_request, "harmonization_map_json": harmonization_map_json}, llm_providers)
         if cli_args.verbose:
             print(f"Raw LLM response: {plan_json_str}") # Debug print
         plan_json_str = plan_json_str.strip()
@@ -279,9 +544,9 @@ User Request: {user_request}
             plan_json_str = plan_json_str[json_start : json_end + 1]
         else:
             raise ValueError("Could not find a valid JSON array in the LLM response.")
-        plan = json.loads(plan_json_str)
+        plan = json_loads(plan_json_str)
         print("Generated Plan:")
-        print(json.dumps(plan, indent=2))
+        print(json_dumps(plan, indent=2))
     except Exception as e:
         print(f"Error generating or parsing LLM plan: {e}")
         return
@@ -299,13 +564,17 @@ User Request: {user_request}
         args = step.get("args", {})
         output_variable = step.get("output_variable")
 
-        if function_name not in globals() and function_name not in locals():
+        if function_name not in PLANNER_FUNCTIONS:
             print(f"Error: Function '{function_name}' not found for step {step_idx + 1}.")
             return
+        func, accepted_params = PLANNER_FUNCTIONS[function_name]
 
         # Resolve arguments
         resolved_args = {}
         for arg_name, arg_value in args.items():
+            if arg_name not in accepted_params:
+                print(f"Warning: Ignoring unsupported argument '{arg_name}' for '{function_name}' in step {step_idx + 1}.")
+                continue
             if isinstance(arg_value, str) and arg_value.startswith("_") and arg_value.endswith("_"):
                 # Resolve placeholders
                 if arg_value == "_harmonization_map_":
@@ -323,18 +592,12 @@ User Request: {user_request}
                 resolved_args[arg_name] = arg_value
 
         try:
-            # Get the function object
-            func = globals().get(function_name) or locals().get(function_name)
-            if func is None:
-                raise ValueError(f"Function '{function_name}' not found.")
-
-            if args.verbose:
+            if cli_args.verbose:
                 print(f"Executing step {step_idx + 1}: {function_name}({resolved_args})")
             
-            # Dynamically add verbose argument if the function accepts it
-            func_signature = inspect.signature(func)
-            if 'verbose' in func_signature.parameters:
-                resolved_args['verbose'] = args.verbose
+            # Add the verbose argument if the function accepts it
+            if 'verbose' in accepted_params:
+                resolved_args['verbose'] = cli_args.verbose
             
             result = func(**resolved_args)
             
@@ -347,7 +610,7 @@ User Request: {user_request}
                 print(f"Unique values: {result}")
             elif isinstance(result, pl.DataFrame):
                 print("Resulting DataFrame (first 5 rows):")
-                print(result.head().to_pandas().to_markdown(index=False))
+                _print_preview(result)
                 print(f"Shape: {result.shape}")
 
         except Exception as e:
@@ -356,21 +619,25 @@ User Request: {user_request}
 
     print("Manipulation plan executed successfully.")
     # Save the final output if an output file is specified
-    if output_variable and args.output_file:
+    if output_variable and cli_args.output_file:
         output_data = local_vars.get(output_variable)
         if output_data is not None:
-            output_dir = os.path.dirname(args.output_file)
+            output_dir = os.path.dirname(cli_args.output_file)
             if output_dir and not os.path.exists(output_dir):
                 os.makedirs(output_dir)
             
             if isinstance(output_data, list):
-                with open(args.output_file, 'w') as f:
+                with open(cli_args.output_file, 'w') as f:
                     for item in output_data:
                         f.write(f"{item}\n")
-                print(f"Output saved to {args.output_file}")
+                print(f"Output saved to {cli_args.output_file}")
+            elif isinstance(output_data, pl.LazyFrame):
+                # Stream the pipeline into the file without materializing the full result
+                output_data.sink_csv(cli_args.output_file)
+                print(f"Output DataFrame saved to {cli_args.output_file}")
             elif isinstance(output_data, pl.DataFrame):
-                output_data.write_csv(args.output_file)
-                print(f"Output DataFrame saved to {args.output_file}")
+                output_data.write_csv(cli_args.output_file)
+                print(f"Output DataFrame saved to {cli_args.output_file}")
             else:
                 print(f"Warning: Cannot save output of type {type(output_data)} to file.")
 
@@ -394,6 +661,8 @@ def main():
                         help="Optional: Path to save the output of the manipulation (e.g., unique values, merged data).")
     parser.add_argument("--llm_providers", type=str, default="google,nvidia,groq",
                         help="Comma-separated list of LLM providers to use, in order of preference (e.g., 'google,nvidia,groq').")
+    parser.add_argument("--coalesce_by_key", action="store_true",
+                        help="For the 'merge' action, collapse the result to one row per key, keeping each column's first non-null value.")
     parser.add_argument("--verbose", action="store_true",
                         help="Enable verbose output for debugging.")
 
@@ -413,15 +682,14 @@ def main():
 
         all_analyses = {}
         print("---" + " Auto-generating Phase 1: Individual Dataset Analysis " + "---")
-        for filename in os.listdir(args.data_folder_path):
+        for filename in list_dataset_files(args.data_folder_path):
             file_path = os.path.join(args.data_folder_path, filename)
-            if os.path.isfile(file_path):
-                print(f"Analyzing {filename}...")
-                df_sample = read_dataset_sample(file_path)
-                if df_sample is not None:
-                    analysis = analyze_individual_dataset(file_path, df_sample, [p.strip() for p in args.llm_providers.split(',')])
-                    if analysis:
-                        all_analyses[filename] = analysis
+            print(f"Analyzing {filename}...")
+            df_sample = read_dataset_sample(file_path)
+            if df_sample is not None:
+                analysis, _ = analyze_individual_dataset(file_path, df_sample, [p.strip() for p in args.llm_providers.split(',')])
+                if analysis:
+                    all_analyses[filename] = analysis
 
         if not all_analyses:
             print("No datasets were successfully analyzed for auto-generation of harmonization map.")
@@ -435,8 +703,8 @@ def main():
             return
 
         try:
-            with open(auto_generated_map_path, 'w') as f:
-                json.dump(harmonization_map, f, indent=2)
+            with open(auto_generated_map_path, 'w', encoding='utf-8') as f: # json_dumps may emit raw UTF-8
+                f.write(json_dumps(harmonization_map, indent=2))
             print(f"\nAuto-generated harmonization map saved to: {auto_generated_map_path}")
             args.harmonization_map_path = auto_generated_map_path # Update path for subsequent use
         except Exception as e:
@@ -469,13 +737,16 @@ def main():
             print("Error: --canonical_feature (merge key) is required for 'merge' action.")
             return
         print(f"Merging datasets by canonical key: '{args.canonical_feature}'...")
-        merged_df = merge_datasets_by_canonical_key(harmonization_map, args.data_folder_path, args.canonical_feature)
-        if merged_df is not None and not merged_df.is_empty():
+        merged_df = merge_datasets_by_canonical_key(harmonization_map, args.data_folder_path, args.canonical_feature,
+                                                    sink_to=args.output_file, coalesce_by_key=args.coalesce_by_key)
+        if merged_df is None:
+            print("No data merged or merged DataFrame is empty.")
+        elif args.output_file:
+            print(f"Merged data saved to {args.output_file}")
+        elif not merged_df.is_empty():
             print("Merged DataFrame (first 5 rows):")
-            print(merged_df.head().to_pandas().to_markdown(index=False)) # Convert to pandas for markdown printing
+            _print_preview(merged_df)
             print(f"\nMerged DataFrame shape: {merged_df.shape}")
-            # You might want to save this merged_df to a file here
-            # e.g., merged_df.write_csv("merged_data.csv")
         else:
             print("No data merged or merged DataFrame is empty.")
 
@@ -484,29 +755,20 @@ def main():
             print("Error: --canonical_feature and --filter_value are required for 'filter' action.")
             return
         
-        # For filtering, we need to merge all data first to have a single DataFrame to filter
-        print(f"Merging all datasets to filter by '{args.canonical_feature}' == '{args.filter_value}'...")
-        # A common merge key might be needed here, or merge all and then filter
-        # For this example, we'll merge all data using the first canonical feature as a dummy merge key if no specific merge key is provided.
-        dummy_merge_key = harmonization_map[0]["canonical_name"] if harmonization_map else None
-        if not dummy_merge_key:
-            print("Error: Cannot perform filter action without a canonical feature to merge on.")
-            return
+        print(f"Filtering all datasets by '{args.canonical_feature}' == '{args.filter_value}'...")
+        filtered_df = scan_and_filter_all(harmonization_map, args.data_folder_path, args.canonical_feature, args.filter_value,
+                                          sink_to=args.output_file)
 
-        all_data_df = merge_datasets_by_canonical_key(harmonization_map, args.data_folder_path, dummy_merge_key)
-        
-        if all_data_df is not None and not all_data_df.is_empty():
-            print(f"Filtering DataFrame by '{args.canonical_feature}' == '{args.filter_value}'...")
-            filtered_df = filter_dataframe_by_canonical_value(all_data_df, args.canonical_feature, args.filter_value)
-            if not filtered_df.is_empty():
-                print("Filtered DataFrame (first 5 rows):")
-                print(filtered_df.head().to_pandas().to_markdown(index=False)) # Convert to pandas for markdown printing
-                print(f"\nFiltered DataFrame shape: {filtered_df.shape}")
-                # You might want to save this filtered_df to a file here
-            else:
-                print(f"No data found matching filter: '{args.canonical_feature}' == '{args.filter_value}'.")
-        else:
+        if filtered_df is None:
             print("No data available to filter.")
+        elif args.output_file:
+            print(f"Filtered data saved to {args.output_file}")
+        elif not filtered_df.is_empty():
+            print("Filtered DataFrame (first 5 rows):")
+            _print_preview(filtered_df)
+            print(f"\nFiltered DataFrame shape: {filtered_df.shape}")
+        else:
+            print(f"No data found matching filter: '{args.canonical_feature}' == '{args.filter_value}'.")
 
     elif args.action == "llm_guided_manipulation":
         if not args.request:
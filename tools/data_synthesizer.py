@@ -1,16 +1,12 @@
-import json
 from langchain.prompts import PromptTemplate
 from tools.llm_manager import get_llm_response
+from tools.utils import json_loads, json_dumps, extract_json_block
 
-def synthesize_analyses(all_analyses, additional_prompt="", llm_providers=None):
-    """
-    Synthesizes analyses from multiple datasets to find common features.
-    """
-    template = """
+# Laid out like ANALYSIS_INSTRUCTIONS in data_analyzer: static instructions first, per-run data last
+SYNTHESIS_TEMPLATE = """
     You are a research assistant. Your goal is to harmonize multiple dataset analyses to help a researcher understand how their data fits together.
 
-    Here are the individual analyses from multiple dataset files:
-    {analyses_json}
+    The individual analyses from multiple dataset files are provided at the end of this prompt.
 
     Based on the provided analyses, perform the following tasks and provide the output in a single JSON object.
 
@@ -71,18 +67,29 @@ def synthesize_analyses(all_analyses, additional_prompt="", llm_providers=None):
 
     Provide only the JSON output.
 
+    Here are the individual analyses from multiple dataset files:
+    {analyses_json}
+
     {additional_prompt}
     """
 
+# Built once at import so the template is validated a single time, not on every synthesis call
+SYNTHESIS_PROMPT = PromptTemplate(template=SYNTHESIS_TEMPLATE, input_variables=["analyses_json", "additional_prompt"])
+
+def synthesize_analyses(all_analyses, additional_prompt="", llm_providers=None):
+    """
+    Synthesizes analyses from multiple datasets to find common features.
+    """
     # No need to create dataset_metadata separately, the LLM will do it.
     input_variables = {
-        "analyses_json": json.dumps(all_analyses, indent=2),
+        # Compact output: the LLM does not need pretty-printing, and indentation can double the prompt size
+        "analyses_json": json_dumps(all_analyses),
         "additional_prompt": additional_prompt
     }
 
     try:
-        result_content, _ = get_llm_response(template, input_variables, llm_providers)
-        cleaned_result = result_content.strip().replace("```json", "").replace("```", "")
-        return json.loads(cleaned_result)
+        result_content, _ = get_llm_response(SYNTHESIS_PROMPT.template, input_variables, llm_providers)
+        cleaned_result = extract_json_block(result_content)
+        return json_loads(cleaned_result)
     except Exception as e:
         return f"An error occurred during synthesis: {e}"
\ No newline at end of file
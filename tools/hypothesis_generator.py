@@ -1,5 +1,6 @@
 import json
 from tools.llm_manager import get_llm_response
+from tools.utils import json_loads
 from langchain.prompts import PromptTemplate
 
 def generate_hypotheses(harmonization_map_path: str, llm_providers: list[str], field_of_interest: str, web_context: str = ""):
@@ -13,8 +14,8 @@ def generate_hypotheses(harmonization_map_path: str, llm_providers: list[str], f
         field_of_interest (str): The specific field the user wants to relate the dataset to.
     """
     try:
-        with open(harmonization_map_path, 'r') as f:
-            harmonization_map = json.load(f)
+        with open(harmonization_map_path, 'rb') as f:
+            harmonization_map = json_loads(f.read())
     except FileNotFoundError:
         print(f"Error: The file '{harmonization_map_path}' was not found.")
         return
@@ -65,6 +66,15 @@ def generate_hypotheses(harmonization_map_path: str, llm_providers: list[str], f
         ensuring they are specific, measurable, and relevant to both the dataset features and {field_of_interest}.]
         """)
 
+    # Print the response as it streams in, so long answers are readable before generation finishes
+    header_printed = False
+    def print_chunk(text):
+        nonlocal header_printed
+        if not header_printed:
+            print("\n--- Generated Hypotheses and Insights ---")
+            header_printed = True
+        print(text, end="", flush=True)
+
     print("Generating hypotheses and insights...")
     hypotheses, _ = get_llm_response(
         prompt_template,
@@ -73,13 +83,11 @@ def generate_hypotheses(harmonization_map_path: str, llm_providers: list[str], f
             "field_of_interest": field_of_interest,
             "web_context": web_context
         },
-        llm_providers
+        llm_providers,
+        on_chunk=print_chunk
     )
 
-    if hypotheses:
-        print("\n--- Generated Hypotheses and Insights ---")
-        print(hypotheses)
-    else:
+    if not hypotheses:
         print("Could not generate hypotheses and insights. The LLM did not return a response.")
 
 
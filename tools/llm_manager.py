@@ -1,4 +1,9 @@
 import os
+import time
+import functools
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
 import google.generativeai as genai # Import raw Google GenAI
 from openai import OpenAI # For NVIDIA
 from groq import Groq # For Groq
@@ -7,91 +12,220 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-def get_llm_response(prompt_template, input_variables, providers_to_try=None):
+# Responses keyed by the SHA-256 of the fully formatted prompt, so identical prompts within a run skip the round trip
+_response_cache = {}
+
+# Retries per provider when it answers with HTTP 429, backing off 1s, 2s, 4s, ... (capped at 30s)
+RATE_LIMIT_RETRIES = 3
+
+def _is_rate_limited(error):
+    """
+    Checks whether a provider error is a rate-limit (HTTP 429) response.
+    """
+    status_code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status_code == 429 or type(error).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+
+# One keep-alive connection pool shared by the OpenAI-compatible clients (NVIDIA and Groq), so TCP and TLS
+# setup is paid once per host rather than on every request
+_HTTP_CLIENT = httpx.Client(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+
+# Each SDK keeps its own default timeout; passed explicitly so the shared pool's settings never override it
+NVIDIA_TIMEOUT = httpx.Timeout(600.0, connect=5.0) # OpenAI SDK default
+GROQ_TIMEOUT = httpx.Timeout(60.0, connect=5.0) # Groq SDK default, so a stalled Groq call falls back quickly
+
+# Clients are created once per API key and reused, so repeated calls keep their connection pools warm
+@functools.lru_cache(maxsize=None)
+def _get_google_model(api_key, model_name):
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+@functools.lru_cache(maxsize=None)
+def _get_nvidia_client(api_key):
+    return OpenAI(
+        base_url="https://integrate.api.nvidia.com/v1",
+        api_key=api_key,
+        http_client=_HTTP_CLIENT,
+        timeout=NVIDIA_TIMEOUT
+    )
+
+@functools.lru_cache(maxsize=None)
+def _get_groq_client(api_key):
+    return Groq(api_key=api_key, http_client=_HTTP_CLIENT, timeout=GROQ_TIMEOUT)
+
+def _collect_stream(chunks, on_chunk):
+    """
+    Forwards each streamed text chunk to on_chunk and returns the full response text.
+    """
+    parts = []
+    for text in chunks:
+        if text:
+            on_chunk(text)
+            parts.append(text)
+    return "".join(parts)
+
+def _completion_text(completion, on_chunk):
+    """
+    Returns the text of an OpenAI-compatible chat completion, streamed through on_chunk if one is given.
+    """
+    if on_chunk is None:
+        return completion.choices[0].message.content
+    return _collect_stream((chunk.choices[0].delta.content for chunk in completion if chunk.choices), on_chunk)
+
+def _call_provider(provider, formatted_prompt, on_chunk=None):
+    """
+    Sends an already formatted prompt to a single LLM provider and returns the response content.
+    If on_chunk is given the response is streamed and each text chunk is passed to it as it arrives.
+    Returns None if the provider's API key is missing or the provider is unknown.
+    """
+    if provider == "google":
+        google_api_key = os.getenv("GOOGLE_API_KEY")
+        if not google_api_key:
+            print("Google API Key not found. Skipping Google LLM.")
+            return None
+        model = _get_google_model(google_api_key, 'gemini-1.5-flash')
+        response = model.generate_content(formatted_prompt, stream=on_chunk is not None)
+        if on_chunk is not None:
+            return _collect_stream((chunk.text for chunk in response), on_chunk)
+        return response.text
+
+    elif provider == "nvidia":
+        nvidia_api_key = os.getenv("NVIDIA_API_KEY")
+        if not nvidia_api_key:
+            print("NVIDIA API Key not found. Skipping NVIDIA LLM.")
+            return None
+        client = _get_nvidia_client(nvidia_api_key)
+
+        completion = client.chat.completions.create(
+            model="meta/llama-3.3-70b-instruct",
+            messages=[{"role": "user", "content": formatted_prompt}],
+            temperature=0.2,
+            top_p=0.7,
+            max_tokens=8192,
+            stream=on_chunk is not None
+        )
+        return _completion_text(completion, on_chunk)
+
+    elif provider == "nvidia_nemotron":
+        nvidia_api_key = os.getenv("NVIDIA_API_KEY")
+        if not nvidia_api_key:
+            print("NVIDIA API Key not found. Skipping NVIDIA Nemotron LLM.")
+            return None
+        client = _get_nvidia_client(nvidia_api_key)
+
+        completion = client.chat.completions.create(
+            model="nvidia/llama-3.1-nemotron-ultra-253b-v1",
+            messages=[{"role": "user", "content": formatted_prompt}],
+            temperature=0.6,
+            top_p=0.95,
+            max_tokens=4096,
+            stream=on_chunk is not None
+        )
+        return _completion_text(completion, on_chunk)
+
+    elif provider == "groq":
+        groq_api_key = os.getenv("GROQ_API_KEY")
+        if not groq_api_key:
+            print("Groq API Key not found. Skipping Groq LLM.")
+            return None
+        client = _get_groq_client(groq_api_key)
+
+        completion = client.chat.completions.create(
+            model="llama-3.1-8b-instant",
+            messages=[{"role": "user", "content": formatted_prompt}],
+            temperature=1,
+            max_completion_tokens=8192,
+            top_p=1,
+            stream=on_chunk is not None
+        )
+        return _completion_text(completion, on_chunk)
+
+    return None
+
+class _StreamTracker:
+    """
+    Forwards streamed text chunks to a callback and remembers whether any have been emitted.
+    """
+    def __init__(self, on_chunk):
+        self.on_chunk = on_chunk
+        self.emitted = False
+
+    def __call__(self, text):
+        self.emitted = True
+        self.on_chunk(text)
+
+def _call_with_retries(provider, formatted_prompt, on_chunk=None):
+    """
+    Calls a single provider, retrying with exponential backoff while it is rate limited.
+    Returns None if the provider is unavailable or fails.
+    A streamed call is not retried once part of its response has been emitted.
+    """
+    print(f"Attempting to use {provider.capitalize()} LLM...")
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        try:
+            content = _call_provider(provider, formatted_prompt, on_chunk)
+        except Exception as e:
+            if on_chunk is not None and on_chunk.emitted:
+                print() # End the line the partial output was written on
+            elif _is_rate_limited(e) and attempt < RATE_LIMIT_RETRIES:
+                delay = min(2 ** attempt, 30)
+                print(f"{provider.capitalize()} LLM is rate limited. Retrying in {delay}s...")
+                time.sleep(delay)
+                continue
+            print(f"{provider.capitalize()} LLM failed: {e}.")
+            return None
+
+        if content is not None:
+            if on_chunk is not None:
+                print() # End the line the streamed output was written on
+            print(f"Successfully got response from {provider.capitalize()} LLM.")
+        return content
+    return None
+
+def get_llm_response(prompt_template, input_variables, providers_to_try=None, race=False, on_chunk=None):
     """
     Attempts to get a response from an LLM, with fallback mechanisms.
-    Returns the response content and the name of the successful provider.
+    Returns the response content and the name of the successful provider, or (None, None) if every provider fails.
+    Identical prompts within a run are answered from an in-memory cache.
+    A rate-limited provider is retried with exponential backoff before falling back to the next one.
+    With race=True all providers are asked at once and the first successful answer wins,
+    trading extra API usage for the latency of the fastest healthy provider.
+    With on_chunk the response is streamed and each text chunk is passed to it as it arrives (ignored when racing).
+    If a streamed response fails after part of it was emitted, no other provider is tried, so answers are never spliced together.
     """
     llm_providers = providers_to_try if providers_to_try is not None else ["groq", "google", "nvidia", "nvidia_nemotron"] # Prioritize Groq
 
-    for provider in llm_providers:
-        print(f"Attempting to use {provider.capitalize()} LLM...")
+    # Formatted once and reused for the cache key and for every provider attempt and retry
+    formatted_prompt = prompt_template.format(**input_variables)
+    cache_key = hashlib.sha256(formatted_prompt.encode('utf-8')).hexdigest()
+    cached_response = _response_cache.get(cache_key)
+    if cached_response is not None:
+        print(f"Using cached response from {cached_response[1].capitalize()} LLM.")
+        if on_chunk is not None:
+            on_chunk(cached_response[0])
+        return cached_response
+
+    if race and len(llm_providers) > 1:
+        executor = ThreadPoolExecutor(max_workers=len(llm_providers))
+        futures = {executor.submit(_call_with_retries, provider, formatted_prompt): provider for provider in llm_providers}
         try:
-            if provider == "google":
-                google_api_key = os.getenv("GOOGLE_API_KEY")
-                if not google_api_key:
-                    print("Google API Key not found. Skipping Google LLM.")
-                    continue
-                genai.configure(api_key=google_api_key)
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                formatted_prompt = prompt_template.format(**input_variables)
-                response = model.generate_content(formatted_prompt)
-                print(f"Successfully got response from {provider.capitalize()} LLM.")
-                return response.text, provider
-
-            elif provider == "nvidia":
-                nvidia_api_key = os.getenv("NVIDIA_API_KEY")
-                if not nvidia_api_key:
-                    print("NVIDIA API Key not found. Skipping NVIDIA LLM.")
-                    continue
-                client = OpenAI(
-                    base_url="https://integrate.api.nvidia.com/v1",
-                    api_key=nvidia_api_key
-                )
-                formatted_prompt = prompt_template.format(**input_variables)
-
-                completion = client.chat.completions.create(
-                    model="meta/llama-3.3-70b-instruct",
-                    messages=[{"role": "user", "content": formatted_prompt}],
-                    temperature=0.2,
-                    top_p=0.7,
-                    max_tokens=8192,
-                    stream=False
-                )
-                print(f"Successfully got response from {provider.capitalize()} LLM.")
-                return completion.choices[0].message.content, provider
-
-            elif provider == "nvidia_nemotron":
-                nvidia_api_key = os.getenv("NVIDIA_API_KEY")
-                if not nvidia_api_key:
-                    print("NVIDIA API Key not found. Skipping NVIDIA Nemotron LLM.")
-                    continue
-                client = OpenAI(
-                    base_url="https://integrate.api.nvidia.com/v1",
-                    api_key=nvidia_api_key
-                )
-                formatted_prompt = prompt_template.format(**input_variables)
-
-                completion = client.chat.completions.create(
-                    model="nvidia/llama-3.1-nemotron-ultra-253b-v1",
-                    messages=[{"role": "user", "content": formatted_prompt}],
-                    temperature=0.6,
-                    top_p=0.95,
-                    max_tokens=4096,
-                    stream=False
-                )
-                print(f"Successfully got response from {provider.capitalize()} LLM.")
-                return completion.choices[0].message.content, provider
-
-            elif provider == "groq":
-                groq_api_key = os.getenv("GROQ_API_KEY")
-                if not groq_api_key:
-                    print("Groq API Key not found. Skipping Groq LLM.")
-                    continue
-                client = Groq(api_key=groq_api_key)
-                formatted_prompt = prompt_template.format(**input_variables)
-
-                completion = client.chat.completions.create(
-                    model="llama-3.1-8b-instant",
-                    messages=[{"role": "user", "content": formatted_prompt}],
-                    temperature=1,
-                    max_completion_tokens=8192,
-                    top_p=1,
-                    stream=False
-                )
-                print(f"Successfully got response from {provider.capitalize()} LLM.")
-                return completion.choices[0].message.content, provider
+            for future in as_completed(futures):
+                content = future.result()
+                if content is not None:
+                    _response_cache[cache_key] = (content, futures[future])
+                    return _response_cache[cache_key]
+        finally:
+            # Slower providers are abandoned once one has answered; queued attempts are cancelled
+            executor.shutdown(wait=False, cancel_futures=True)
+        return None, None
 
-        except Exception as e:
-            print(f"{provider.capitalize()} LLM failed: {e}. Trying next provider.")
-            continue
+    for provider in llm_providers:
+        tracker = _StreamTracker(on_chunk) if on_chunk is not None else None
+        content = _call_with_retries(provider, formatted_prompt, tracker)
+        if content is not None:
+            _response_cache[cache_key] = (content, provider)
+            return _response_cache[cache_key]
+        if tracker is not None and tracker.emitted:
+            print("Not falling back to another provider: part of the response was already streamed.")
+            return None, None
+        print("Trying next provider.")
+    return None, None
@@ -1,35 +1,149 @@
+import csv
+import hashlib
+import io
+import itertools
 import json
+import mmap
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import polars as pl
 
-def parse_json_with_fix(json_string, retries=3):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.compute
+except ImportError:
+    pyarrow = None
+
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+# Rust-backed calamine reader for Excel files when installed (pandas >= 2.2); None keeps pandas' default openpyxl/xlrd
+EXCEL_ENGINE = "calamine" if python_calamine is not None else None
+
+def json_loads(data):
     """
-    Attempts to parse a JSON string, with retries and basic fixing for common issues.
+    Parses JSON from a str or bytes, using orjson when it is installed.
     """
-    for i in range(retries):
-        try:
-            return json.loads(json_string)
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error (attempt {i+1}/{retries}): {e}")
-            # Attempt to fix common issues
-            if "Unterminated string" in str(e) or "Expecting ',' delimiter" in str(e):
-                if json_string.endswith('}'):
-                    json_string += ']'
-                elif json_string.endswith(']'):
-                    json_string += '}'
-                else:
-                    json_string += '}'
-            elif "Expecting property name enclosed in double quotes" in str(e):
-                # This is harder to fix automatically without more context
-                pass
-            
-            if i < retries - 1:
-                print("Attempting to fix JSON and retry...")
-            else:
-                raise # Re-raise if all retries fail
-
-    return json.loads(json_string) # Should not be reached if retries fail
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj, indent=None):
+    """
+    Serializes an object to a JSON string, using orjson when it is installed.
+    orjson only supports compact output or an indent of 2; other indents use the standard library.
+    """
+    if orjson is not None and indent in (None, 2):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent == 2 else 0).decode()
+    return json.dumps(obj, indent=indent)
+
+# Body of a markdown code fence (optionally tagged json) wrapped around an LLM's JSON answer. The closing fence is
+# optional so a reply cut off at the token limit still yields its (truncated) JSON for parse_json_with_fix to repair
+_JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*(.*?)\s*(?:```|\Z)", re.S)
+
+def extract_json_block(text):
+    """
+    Returns the JSON payload of an LLM response, taken from its first markdown code fence if it has one.
+    A single regex scan replaces chained strip/replace calls that each copied the whole response.
+    """
+    match = _JSON_BLOCK_RE.search(text)
+    return match.group(1) if match else text.strip()
+
+# A JSON string (possibly unterminated, in which case group 1 is empty) or a single bracket; the regex engine
+# skips over string bodies in C, so the Python loop below only runs once per string and bracket token
+_JSON_TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*("?)|[{}\[\]]', re.S)
+
+def _close_json(json_string):
+    """
+    Closes an unterminated string and any unclosed objects and arrays of truncated JSON, in one forward scan.
+    """
+    closers = []
+    in_string = False
+    for match in _JSON_TOKEN_RE.finditer(json_string):
+        token = match.group()
+        if token[0] == '"':
+            in_string = not match.group(1)
+            string_end = match.end()
+        elif token == '{':
+            closers.append('}')
+        elif token == '[':
+            closers.append(']')
+        elif closers:
+            closers.pop()
+
+    if in_string:
+        # The unterminated string runs to the end, short of any dangling backslash that would escape the closing quote
+        json_string = json_string[:string_end] + '"'
+    else:
+        # A trailing comma before the added closers would still be invalid
+        json_string = json_string.rstrip().rstrip(',')
+    # Closers are emitted innermost first, in the reverse of the order their brackets were opened
+    return json_string + ''.join(reversed(closers))
+
+def parse_json_with_fix(json_string):
+    """
+    Attempts to parse a JSON string, closing truncated strings, objects and arrays if needed.
+    Well-formed input is parsed once with the fast parser; malformed input is repaired in a single pass and parsed once more.
+    """
+    try:
+        return json_loads(json_string)
+    except ValueError as e:
+        print(f"JSON parsing error: {e}")
+    print("Attempting to fix JSON and retry...")
+    return json_loads(_close_json(json_string)) # Raises if the repaired JSON is still invalid
+
+# Size of the first prefix of a CSV decoded for sampling; doubled until it holds enough complete rows
+CSV_SAMPLE_WINDOW_BYTES = 64 * 1024
+
+def _read_csv_head(file_path, sample_size):
+    """
+    Reads only the header and the first sample_size rows of a CSV into a pandas DataFrame.
+    The file is memory-mapped and only a prefix large enough for those rows is decoded and parsed.
+    Files the csv module rejects, e.g. with a field over its 128 KB field_size_limit, are read by pandas instead.
+    """
+    rows = []
+    try:
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size: # Empty files cannot be mapped; they fall through to pandas' own empty-file error
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    window = CSV_SAMPLE_WINDOW_BYTES
+                    while True:
+                        # Cut the prefix after a newline byte, which never splits a UTF-8 character
+                        end = size if window >= size else mm.rfind(b'\n', 0, window) + 1
+                        if end:
+                            # utf-8-sig drops a leading BOM, as pandas does; blank lines are skipped, as pandas does
+                            reader = csv.reader(io.StringIO(mm[:end].decode('utf-8-sig'), newline=''))
+                            rows = list(itertools.islice((row for row in reader if row), sample_size + 2))
+                            # Unless the whole file was parsed, the last row may be cut short inside a quoted field
+                            if end == size or len(rows) > sample_size + 1:
+                                break
+                        window *= 2
+    except csv.Error:
+        return pd.read_csv(file_path, nrows=sample_size)
+    # Re-parse just the header and sampled rows so pandas still infers the column types
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows[:sample_size + 1])
+    buffer.seek(0)
+    return pd.read_csv(buffer)
+
+def _read_excel_head(file_path, sample_size):
+    """
+    Reads only the first sample_size rows of an Excel file into a pandas DataFrame.
+    """
+    return pd.read_excel(file_path, nrows=sample_size, engine=EXCEL_ENGINE)
+
+# Sample reader per file extension: one dict lookup per read, and a new format only needs an entry here
+_SAMPLE_READERS = {'.csv': _read_csv_head, '.xlsx': _read_excel_head, '.xls': _read_excel_head}
 
 def read_dataset_sample(file_path, sample_size=5):
     """
@@ -37,56 +151,305 @@ def read_dataset_sample(file_path, sample_size=5):
     For CSV and Excel files, it returns a pandas DataFrame.
     For other file types, it returns None.
     """
+    reader = _SAMPLE_READERS.get(os.path.splitext(file_path)[1])
+    if reader is None:
+        return None
     try:
-        if file_path.endswith('.csv'):
-            return pd.read_csv(file_path, nrows=sample_size)
-        elif file_path.endswith(('.xlsx', '.xls')):
-            return pd.read_excel(file_path, nrows=sample_size)
-        else:
-            return None
+        return reader(file_path, sample_size)
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
         return None
 
+# Parquet copies of previously read datasets, keyed by path, modification time and size.
+# Opt-in: entries for edited files are never cleaned up, so nothing is cached unless a folder is chosen
+DATASET_CACHE_DIR = os.getenv("DATASET_ANALYZER_CACHE_DIR")
+
+def _parquet_cache_path(file_path):
+    """
+    Returns where the Parquet copy of a dataset file is cached. Editing the file changes the path.
+    """
+    stat = os.stat(file_path)
+    key = f"{os.path.abspath(file_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    return os.path.join(DATASET_CACHE_DIR, hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest() + ".parquet")
+
+def _write_parquet_cache(df, cache_path):
+    """
+    Saves a DataFrame as a Parquet cache file. Failures are reported and otherwise ignored.
+    """
+    tmp_path = cache_path + ".tmp"
+    try:
+        os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+        df.to_parquet(tmp_path, engine="pyarrow", index=False)
+        os.replace(tmp_path, cache_path) # Readers never see a partially written cache file
+    except Exception as e:
+        print(f"Could not cache dataset as Parquet at {cache_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _read_csv_full(file_path):
+    """
+    Reads a whole CSV into a pandas DataFrame, with the PyArrow engine when available.
+    """
+    if pyarrow is not None:
+        try:
+            # Multi-threaded native parser with Arrow-backed columns instead of per-cell Python objects
+            return pd.read_csv(file_path, engine="pyarrow", dtype_backend="pyarrow")
+        except Exception as e:
+            print(f"PyArrow could not parse {file_path}, falling back to the default parser: {e}")
+    return pd.read_csv(file_path)
+
+def _read_excel_full(file_path):
+    """
+    Reads a whole Excel file into a pandas DataFrame.
+    """
+    return pd.read_excel(file_path, engine=EXCEL_ENGINE)
+
+# Full reader per file extension, mirroring _SAMPLE_READERS
+_FULL_READERS = {'.csv': _read_csv_full, '.xlsx': _read_excel_full, '.xls': _read_excel_full}
+
 def read_full_dataset(file_path):
     """
     Reads a full dataset file and returns a pandas DataFrame.
-    For CSV and Excel files, it returns a pandas DataFrame.
+    For CSV and Excel files, it returns a pandas DataFrame (Arrow-backed for CSV when pyarrow is installed).
     For other file types, it returns None.
+    When DATASET_ANALYZER_CACHE_DIR is set and pyarrow is installed, the parsed frame is cached there as Parquet
+    so later reads of the unchanged file skip parsing.
+    """
+    reader = _FULL_READERS.get(os.path.splitext(file_path)[1])
+    if reader is None:
+        return None
+    try:
+        cache_path = _parquet_cache_path(file_path) if DATASET_CACHE_DIR and pyarrow is not None else None
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                return pd.read_parquet(cache_path, engine="pyarrow")
+            except Exception as e:
+                print(f"Could not read cached {cache_path}, re-reading {file_path}: {e}")
+
+        df = reader(file_path)
+        if cache_path is not None:
+            _write_parquet_cache(df, cache_path)
+        return df
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return None
+
+# CSVs larger than this are read in chunks when they have to go through pandas
+CHUNKED_READ_THRESHOLD_BYTES = 256 * 1024 * 1024
+
+def iter_full_dataset(file_path, chunksize=500_000):
+    """
+    Reads a full dataset file as an iterator of pandas DataFrames of at most chunksize rows, so files larger
+    than memory can be processed block by block. Excel files cannot be streamed and come back as a single chunk.
+    For other file types, or if the file cannot be opened, it returns None.
     """
     try:
         if file_path.endswith('.csv'):
-            return pd.read_csv(file_path)
+            return pd.read_csv(file_path, chunksize=chunksize)
         elif file_path.endswith(('.xlsx', '.xls')):
-            return pd.read_excel(file_path)
+            df = read_full_dataset(file_path)
+            return None if df is None else iter([df])
         else:
             return None
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
         return None
 
+# pandas' default NA markers, so CSV null counts from Polars match what read_full_dataset would report
+PANDAS_NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+def _strip_column_names(columns):
+    """
+    Strips whitespace from column names, suffixing names that then repeat with .1, .2, ... as pandas does for duplicate headers.
+    """
+    seen = set()
+    names = []
+    for column in columns:
+        base = name = column.strip()
+        suffix = 0
+        while name in seen:
+            suffix += 1
+            name = f"{base}.{suffix}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+def _chunked_shape_and_null_counts(file_path):
+    """
+    Computes the shape and per-column NaN/Null counts of a CSV chunk by chunk, keeping only one chunk in memory.
+    """
+    chunks = iter_full_dataset(file_path)
+    if chunks is None:
+        return None, None
+    row_count = 0
+    null_counts = None
+    try:
+        for chunk in chunks:
+            chunk.columns = _strip_column_names(chunk.columns)
+            row_count += len(chunk)
+            chunk_null_counts = len(chunk) - chunk.count()
+            null_counts = chunk_null_counts if null_counts is None else null_counts + chunk_null_counts
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return None, None
+    if null_counts is None:
+        return None, None
+    return [row_count, len(null_counts)], null_counts.to_dict()
+
+def get_dataset_shape_and_null_counts(file_path):
+    """
+    Returns the shape (rows, columns) and per-column NaN/Null counts of a dataset, with column names stripped.
+    CSV files are scanned lazily with Polars and only the counts are materialized, never the rows themselves.
+    Other files fall back to reading the full dataset with pandas, in chunks for large CSVs.
+    Returns (None, None) if the file cannot be read.
+    """
+    if file_path.endswith('.csv'):
+        try:
+            # Every column is read as a string: counting rows and nulls does not need type inference
+            lf = pl.scan_csv(file_path, infer_schema=False, null_values=PANDAS_NA_VALUES)
+            columns = _strip_column_names(lf.collect_schema().names())
+            # Blank lines come back as all-null rows, which pandas skips (skip_blank_lines)
+            lf = lf.filter(~pl.all_horizontal(pl.all().is_null()))
+            row_count, null_counts = pl.collect_all([lf.select(pl.len()), lf.select(pl.all().null_count())])
+            return [row_count.item(), len(columns)], dict(zip(columns, null_counts.row(0)))
+        except Exception as e:
+            print(f"Could not scan {file_path} with Polars, falling back to pandas: {e}")
+
+        if os.path.getsize(file_path) > CHUNKED_READ_THRESHOLD_BYTES:
+            return _chunked_shape_and_null_counts(file_path)
+
+    df_full = read_full_dataset(file_path)
+    if df_full is None:
+        return None, None
+    df_full.columns = _strip_column_names(df_full.columns)
+    # count() tallies non-null values per column in one pass, without building a full boolean isnull() frame
+    return list(df_full.shape), (len(df_full) - df_full.count()).to_dict()
+
 def get_unique_values_sample(df, sample_size=5):
     """
     Gets a sample of unique values from each column of a DataFrame.
+    When pyarrow is installed the frame is converted once and deduplicated with Arrow's hash kernels,
+    instead of dispatching into pandas column by column.
     """
+    if pyarrow is not None:
+        try:
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            # unique() keeps first-appearance order; only the sampled values are converted to Python objects
+            return {
+                column: pyarrow.compute.unique(values).slice(0, sample_size).to_pylist()
+                for column, values in zip(df.columns, table.columns)
+            }
+        except (pyarrow.ArrowException, TypeError, ValueError):
+            pass # e.g. mixed-type object columns Arrow cannot convert; use the per-column pandas path
+
     unique_values = {}
-    for column in df.columns:
+    # items() yields each (column, Series) pair directly instead of re-indexing the DataFrame per column
+    for column, series in df.items():
         try:
-            unique_vals = df[column].unique()
-            # Take a sample of unique values, convert to list for JSON serialization
-            unique_values[column] = unique_vals[:sample_size].tolist()
+            # Keep only the first sample_size distinct values before converting, in order of first appearance,
+            # then convert to list for JSON serialization
+            unique_values[column] = series.drop_duplicates().head(sample_size).tolist()
         except Exception as e:
             print(f"Could not get unique values for column {column}: {e}")
             unique_values[column] = []
     return unique_values
 
+def get_unique_values_sample_from_path(file_path, sample_size=5):
+    """
+    Gets a sample of unique values from each column of a whole dataset file, without materializing it.
+    CSV files are scanned lazily with Polars, so only each column's first sample_size distinct values are collected.
+    Returns None if the file type is unsupported or the file cannot be read.
+    """
+    try:
+        if file_path.endswith('.csv'):
+            # Drop blank lines, which Polars reads as all-null rows and pandas skips
+            lf = pl.scan_csv(file_path, ignore_errors=True).filter(~pl.all_horizontal(pl.all().is_null()))
+        elif file_path.endswith(('.xlsx', '.xls')):
+            try:
+                lf = pl.read_excel(file_path, engine="calamine").lazy()
+            except ImportError: # fastexcel is not installed
+                lf = pl.from_pandas(pd.read_excel(file_path, engine=EXCEL_ENGINE)).lazy()
+        else:
+            return None
+        # implode() turns each column's distinct values into a single list, so columns of different lengths fit one row
+        sample = lf.select(pl.all().unique(maintain_order=True).head(sample_size).implode()).collect()
+        return sample.row(0, named=True)
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return None
+
+DATASET_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+def list_dataset_files(folder_path):
+    """
+    Lists the names of dataset files (CSV or Excel) directly inside a folder.
+    Uses os.scandir so file types come from the directory entries without a stat per file.
+    """
+    with os.scandir(folder_path) as entries:
+        return [entry.name for entry in entries if entry.is_file() and entry.name.endswith(DATASET_EXTENSIONS)]
+
+def _scan_folder(folder_path, extensions, file_paths):
+    """
+    Appends the paths of matching files directly inside folder_path and returns its subfolders.
+    Directory entries carry their file type, so no extra stat is needed per entry.
+    """
+    subfolders = []
+    try:
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # Like os.walk, symlinked folders are not descended into
+                    if not entry.is_symlink():
+                        subfolders.append(entry.path)
+                elif entry.name.endswith(extensions):
+                    file_paths.append(entry.path)
+    except OSError:
+        pass # Unreadable folders are skipped, as os.walk does
+    return subfolders
+
+def _extension_tuple(extensions):
+    """
+    Normalizes extensions to a tuple, so str.endswith checks every suffix in one call.
+    A lone string is wrapped rather than split into characters.
+    """
+    return (extensions,) if isinstance(extensions, str) else tuple(extensions)
+
+def _iter_file_paths(folder_path, extensions):
+    """
+    Yields the paths of files under folder_path whose names end with one of extensions, recursing into subfolders.
+    """
+    file_paths = []
+    subfolders = _scan_folder(folder_path, extensions, file_paths)
+    yield from file_paths
+    for subfolder in subfolders:
+        yield from _iter_file_paths(subfolder, extensions)
+
 def get_file_paths(folder_path, extensions):
     """
-    Get all file paths in a folder with given extensions.
+    Get all file paths in a folder with given extensions, yielded lazily as the walk finds them.
+    Only one folder listing is held in memory at a time, and the first paths are available before the walk finishes.
+    extensions may be a single suffix or an iterable of suffixes; matching is case-sensitive.
+    """
+    return _iter_file_paths(folder_path, _extension_tuple(extensions))
+
+def get_file_paths_list(folder_path, extensions):
+    """
+    Get all file paths in a folder with given extensions, as a list.
+    Top-level subfolders are walked concurrently, since traversal time is mostly spent waiting on directory reads.
     """
     file_paths = []
-    for root, _, files in os.walk(folder_path):
-        for file in files:
-            if any(file.endswith(ext) for ext in extensions):
-                file_paths.append(os.path.join(root, file))
+    extensions = _extension_tuple(extensions)
+    subfolders = _scan_folder(folder_path, extensions, file_paths)
+    if len(subfolders) < 2:
+        for subfolder in subfolders:
+            file_paths.extend(_iter_file_paths(subfolder, extensions))
+        return file_paths
+
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4, len(subfolders))) as executor:
+        # map yields in submission order, so the result order matches a sequential walk
+        for subfolder_paths in executor.map(lambda subfolder: list(_iter_file_paths(subfolder, extensions)), subfolders):
+            file_paths.extend(subfolder_paths)
     return file_paths